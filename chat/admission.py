@@ -0,0 +1,232 @@
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Callable, Optional
+
+
+class TokenBucket:
+    """Classic token bucket: `rate` tokens per second, up to `burst` banked."""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = time.monotonic()
+
+    def wait_time(self) -> float:
+        """Seconds until a token is available (0 if one is available now)."""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def consume(self):
+        self.tokens -= 1
+
+
+class RateLimiter:
+    """Token buckets per key (session id, client IP), least recently used dropped first."""
+
+    def __init__(self, rate_per_min: float, burst: float, max_keys: int = 10000):
+        self.rate = rate_per_min / 60.0
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def wait_time(self, key: str) -> float:
+        with self._lock:
+            return self._bucket(key).wait_time()
+
+    def consume(self, key: str):
+        with self._lock:
+            self._bucket(key).consume()
+
+    def _bucket(self, key: str) -> TokenBucket:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(self.rate, self.burst)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+        return bucket
+
+
+# Held across check and charge so concurrent requests can't all pass the check first
+_acquire_lock = threading.Lock()
+
+
+def acquire(*limits: tuple[RateLimiter, str]) -> float:
+    """Charge one token from every (limiter, key) pair, or none of them.
+
+    Returns 0 when admitted, else the longest wait among the empty buckets.
+    """
+    with _acquire_lock:
+        retry_after = max(limiter.wait_time(key) for limiter, key in limits)
+        if retry_after:
+            return retry_after
+        for limiter, key in limits:
+            limiter.consume(key)
+        return 0.0
+
+
+class LatencyWindow:
+    """Running count/avg/max plus percentiles over the most recent samples."""
+
+    def __init__(self, window: int = 1000):
+        self.samples = deque(maxlen=window)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float):
+        with self._lock:
+            self.samples.append(seconds)
+            self.count += 1
+            self.total += seconds
+            self.max = max(self.max, seconds)
+
+    def snapshot(self, prefix: str) -> dict:
+        with self._lock:
+            recent = sorted(self.samples)
+
+            def pct(p):
+                return recent[min(len(recent) - 1, int(p * len(recent)))] if recent else 0.0
+
+            return {
+                f"{prefix}_count": self.count,
+                f"{prefix}_avg_ms": round(1000 * self.total / self.count, 2) if self.count else 0.0,
+                f"{prefix}_p50_ms": round(1000 * pct(0.50), 2),
+                f"{prefix}_p95_ms": round(1000 * pct(0.95), 2),
+                f"{prefix}_max_ms": round(1000 * self.max, 2),
+            }
+
+
+class QueueMetrics:
+    """Queue wait times and admission outcomes, reported by /metrics."""
+
+    def __init__(self, window: int = 1000):
+        self.waits = LatencyWindow(window)
+        self.rejected = 0
+        self.shed = 0
+        self._lock = threading.Lock()
+
+    def record_wait(self, seconds: float):
+        self.waits.record(seconds)
+
+    def record_rejected(self):
+        with self._lock:
+            self.rejected += 1
+
+    def record_shed(self):
+        with self._lock:
+            self.shed += 1
+
+    def snapshot(self) -> dict:
+        stats = self.waits.snapshot("wait")
+        with self._lock:
+            stats.update({"rejected": self.rejected, "shed": self.shed})
+        return stats
+
+
+class _Job:
+    def __init__(self, fn: Callable[[], None], on_shed: Optional[Callable[[], None]], low_priority: bool):
+        self.fn = fn
+        self.on_shed = on_shed
+        self.low_priority = low_priority
+        self.enqueued_at = time.monotonic()
+
+
+class FairScheduler:
+    """Bounded queue served round-robin across keys by a fixed pool of workers.
+
+    Low-priority (image) jobs are refused once the queue reaches `shed_depth`,
+    and when the queue is full a queued low-priority job is dropped to make
+    room for a normal one.
+    """
+
+    def __init__(self, workers: int = 4, max_depth: int = 32, shed_depth: int = 16):
+        self.max_depth = max_depth
+        self.shed_depth = min(shed_depth, max_depth)
+        self.metrics = QueueMetrics()
+        self.workers = workers
+        self.depth = 0
+        self.active = 0
+        self._queues: "OrderedDict[str, deque]" = OrderedDict()
+        self._cond = threading.Condition()
+        for i in range(workers):
+            threading.Thread(target=self._work, name=f"chat-worker-{i}", daemon=True).start()
+
+    def submit(self, key: str, fn: Callable[[], None], on_shed: Optional[Callable[[], None]] = None,
+               low_priority: bool = False) -> bool:
+        """Queue `fn` under `key`. Returns False if the job was not admitted."""
+        shed = None
+        with self._cond:
+            if low_priority and self.depth >= self.shed_depth:
+                self.metrics.record_rejected()
+                return False
+            if self.depth >= self.max_depth:
+                shed = None if low_priority else self._pop_low_priority()
+                if shed is None:
+                    self.metrics.record_rejected()
+                    return False
+            self._queues.setdefault(key, deque()).append(_Job(fn, on_shed, low_priority))
+            self.depth += 1
+            self._cond.notify()
+
+        if shed is not None:
+            self.metrics.record_shed()
+            if shed.on_shed:
+                shed.on_shed()
+        return True
+
+    def idle(self) -> bool:
+        """True when nothing is queued and at least one worker is free."""
+        with self._cond:
+            return self.depth == 0 and self.active < self.workers
+
+    def stats(self) -> dict:
+        with self._cond:
+            stats = {"depth": self.depth, "max_depth": self.max_depth, "active": self.active,
+                     "sessions_waiting": len(self._queues)}
+        stats.update(self.metrics.snapshot())
+        return stats
+
+    def _pop_low_priority(self) -> Optional[_Job]:
+        # Newest queued image job goes first, it has waited the least
+        for key in reversed(self._queues):
+            jobs = self._queues[key]
+            for job in reversed(jobs):
+                if job.low_priority:
+                    jobs.remove(job)
+                    if not jobs:
+                        del self._queues[key]
+                    self.depth -= 1
+                    return job
+        return None
+
+    def _next_job(self) -> _Job:
+        with self._cond:
+            self._cond.wait_for(lambda: self.depth > 0)
+            key, jobs = self._queues.popitem(last=False)
+            job = jobs.popleft()
+            if jobs:
+                # Back of the line, so other sessions get a turn first
+                self._queues[key] = jobs
+            self.depth -= 1
+            self.active += 1
+            return job
+
+    def _work(self):
+        while True:
+            job = self._next_job()
+            self.metrics.record_wait(time.monotonic() - job.enqueued_at)
+            try:
+                job.fn()
+            except Exception as e:
+                print(f"❌ Scheduled job error: {e}")
+            finally:
+                with self._cond:
+                    self.active -= 1
@@ -1,15 +1,16 @@
 from flask import Flask, request, Response, stream_with_context
 # from flask_cors import CORS
 from datetime import datetime
-import requests, time, os, re
+import requests, math, time, os, re, uuid
 from dotenv import load_dotenv
 from sentence_transformers import SentenceTransformer
 from transformers import AutoTokenizer
-from models import (
-    save_user_question, save_chat_message, save_session, session_exists,
-    get_last_n_messages, get_total_chat_messages,
-    get_chat_summary, save_chat_summary, clear_database
-)
+from storage import create_repository
+from streams import AnswerStore, iter_bytes, iter_sse
+from admission import FairScheduler, LatencyWindow, RateLimiter, acquire
+from werkzeug.middleware.proxy_fix import ProxyFix
+from prefetch import PrefetchCache
+from concurrent.futures import ThreadPoolExecutor
 from langgraph.graph import StateGraph, END
 from typing_extensions import TypedDict
 from typing import Optional
@@ -21,16 +22,53 @@ VECTOR_SERVICE_URL = os.getenv("VECTOR_SERVICE_URL", "http://vector:5002/query")
 AI_SERVICE_URL = os.getenv("AI_SERVICE_URL", "http://ai:5003/generate")
 SUMMARY_URL = os.getenv("AI_SUMMARY_URL", f"{AI_SERVICE_URL}/summarize")
 
+# Generated answers are buffered so a dropped client can resume instead of re-asking
+ANSWER_BUFFER_SIZE = int(os.getenv("ANSWER_BUFFER_SIZE", "256"))
+ANSWER_BUFFER_TTL = float(os.getenv("ANSWER_BUFFER_TTL", "600"))
+AI_ERROR_ANSWER = "Sorry, internal error occurred."
+# Appended when generation fails after part of the answer was already streamed
+INTERRUPTED_MARKER = "\n\n⚠️ Sorry, this answer was interrupted by an error. Please ask again."
+
+# Admission control: per-session and per-IP token buckets, fair queue in front of the workflow
+SESSION_RATE_PER_MIN = float(os.getenv("SESSION_RATE_PER_MIN", "10"))
+SESSION_BURST = float(os.getenv("SESSION_BURST", "3"))
+IP_RATE_PER_MIN = float(os.getenv("IP_RATE_PER_MIN", "30"))
+IP_BURST = float(os.getenv("IP_BURST", "10"))
+# Proxies in front of this service whose X-Forwarded-For can be trusted (0 = none)
+TRUSTED_PROXY_HOPS = int(os.getenv("TRUSTED_PROXY_HOPS", "0"))
+CHAT_WORKERS = int(os.getenv("CHAT_WORKERS", "4"))
+CHAT_QUEUE_DEPTH = int(os.getenv("CHAT_QUEUE_DEPTH", "32"))
+IMAGE_SHED_DEPTH = int(os.getenv("IMAGE_SHED_DEPTH", "16"))
+
+# Speculative retrieval from the draft while the user is typing
+PREFETCH_TTL = float(os.getenv("PREFETCH_TTL", "30"))
+PREFETCH_MIN_INTERVAL = float(os.getenv("PREFETCH_MIN_INTERVAL", "0.5"))
+PREFETCH_MIN_SIMILARITY = float(os.getenv("PREFETCH_MIN_SIMILARITY", "0.95"))
+PREFETCH_MIN_CHARS = int(os.getenv("PREFETCH_MIN_CHARS", "12"))
+PREFETCH_TIMEOUT = float(os.getenv("PREFETCH_TIMEOUT", "5"))
+
 # Flask & embeddings
 app = Flask(__name__)
+if TRUSTED_PROXY_HOPS:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXY_HOPS)
 # CORS(app)
 embedder = SentenceTransformer("all-MiniLM-L6-v2")
 tokenizer = AutoTokenizer.from_pretrained("bert-base-uncased")
+repo = create_repository()
+answer_store = AnswerStore(max_answers=ANSWER_BUFFER_SIZE, ttl=ANSWER_BUFFER_TTL)
+session_limiter = RateLimiter(SESSION_RATE_PER_MIN, SESSION_BURST)
+ip_limiter = RateLimiter(IP_RATE_PER_MIN, IP_BURST)
+scheduler = FairScheduler(workers=CHAT_WORKERS, max_depth=CHAT_QUEUE_DEPTH, shed_depth=IMAGE_SHED_DEPTH)
+turn_latency = LatencyWindow()
+prefetch_cache = PrefetchCache(ttl=PREFETCH_TTL, min_interval=PREFETCH_MIN_INTERVAL,
+                               min_similarity=PREFETCH_MIN_SIMILARITY)
+prefetch_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="prefetch")
 
 @app.after_request
 def after_request(response):
     response.headers.add('Access-Control-Allow-Origin', '*')
-    response.headers.add('Access-Control-Allow-Headers', 'Content-Type,Authorization')
+    response.headers.add('Access-Control-Allow-Headers', 'Content-Type,Authorization,Last-Event-ID')
+    response.headers.add('Access-Control-Expose-Headers', 'X-Message-Id')
     response.headers.add('Access-Control-Allow-Methods', 'GET,PUT,POST,DELETE,OPTIONS')
     return response
 
@@ -38,6 +76,7 @@ def after_request(response):
 # Chat state type
 class ChatState(TypedDict):
     session_id: str
+    message_id: str
     user_input: str
     input_type: str
     file_data: Optional[dict]
@@ -45,6 +84,7 @@ class ChatState(TypedDict):
     chat_history: str
     chat_summary: str
     retrieved_chunks: list
+    prefetched: bool
     final_answer: str
     error_message: Optional[str]
 
@@ -54,10 +94,57 @@ def preprocess_text(text: str) -> str:
     text = re.sub(r'[^\w\s\.\,\?\!\-\(\)]', ' ', text)
     return text
 
+def client_ip() -> str:
+    # Forwarded headers are only honoured through ProxyFix (TRUSTED_PROXY_HOPS)
+    return request.remote_addr or "unknown"
+
 @app.route("/ping", methods=["GET"])
 def ping():
     return "pong", 200
 
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    return {
+        "queue": scheduler.stats(),
+        "turn": turn_latency.snapshot("latency"),
+        "prefetch": prefetch_cache.stats(),
+    }
+
+def run_prefetch(session_id: str, draft: str):
+    # Turns always embed their own text, so only the vector round trip counts as saved
+    elapsed = 0.0
+    embedding, chunks = None, []
+    try:
+        # Re-check: turns may have arrived while this was waiting
+        if scheduler.idle():
+            embedding = embedder.encode(draft).tolist()
+            started = time.perf_counter()
+            response = requests.post(VECTOR_SERVICE_URL, json={"embedding": embedding},
+                                     timeout=PREFETCH_TIMEOUT)
+            response.raise_for_status()
+            chunks = response.json().get("chunks", [])
+            elapsed = time.perf_counter() - started
+    except Exception as e:
+        print(f"⚠️ Prefetch error: {e}")
+        embedding = None
+    finally:
+        prefetch_cache.finish(session_id, draft, embedding, chunks, elapsed)
+
+@app.route("/prefetch", methods=["POST"])
+def prefetch_route():
+    """Warm the retrieval cache for a session from the message being typed"""
+    session_id = request.form.get("session_id")
+    draft = preprocess_text(request.form.get("draft", ""))
+    if not session_id or len(draft) < PREFETCH_MIN_CHARS:
+        return {"status": "skipped"}, 202
+
+    # Real turns always win: only prefetch when no turn is waiting for a worker
+    if not scheduler.idle() or not prefetch_cache.begin(session_id, draft):
+        return {"status": "skipped"}, 202
+
+    prefetch_executor.submit(run_prefetch, session_id, draft)
+    return {"status": "accepted"}, 202
+
 # Nodes
 def check_input(state: ChatState) -> ChatState:
     file = state.get("file_data")
@@ -67,41 +154,52 @@ def check_input(state: ChatState) -> ChatState:
         state["input_type"] = "text"
     return state
 
-def route_after_input_check(state: ChatState) -> str:
-    print("\nRouting based on input type...")
-    input_type = state.get("input_type", "text")
-    if input_type == "image":
-        return "generate_answer"
-    else:
-        return "embed_text"
-
-def embed_text(state: ChatState) -> ChatState:
+# load_context and the embed -> query_vector branch run in the same step, so
+# they return only the keys they change; writing the same key twice is an error.
+def load_context(state: ChatState) -> dict:
+    session_id = state["session_id"]
+    if not repo.session_exists(session_id):
+        repo.save_session(session_id, datetime.utcnow())
+
+    summary = repo.get_chat_summary(session_id)
+    chat_history = repo.get_last_n_messages(session_id, 6)
+    chat_history_str = "\n".join([f"User: {q}\nBot: {a}" for q, a in chat_history])
+    return {"chat_summary": summary, "chat_history": chat_history_str}
+
+def embed_text(state: ChatState) -> dict:
+    # Image questions are answered from the image itself, without retrieval
+    if state.get("input_type") == "image":
+        return {"embedding": None}
     try:
         input_text = preprocess_text(state.get("user_input", ""))
-        state["embedding"] = embedder.encode(input_text).tolist()
+        # Always the turn's own embedding: it is what save_user_question stores
+        embedding = embedder.encode(input_text).tolist()
+        # Reuse chunks warmed by /prefetch while the user was typing
+        entry = prefetch_cache.take(state["session_id"], input_text, embedding)
+        if entry:
+            return {"embedding": embedding, "retrieved_chunks": entry.chunks, "prefetched": True}
+        return {"embedding": embedding}
     except Exception as e:
-        state["error_message"] = f"Embedding error: {e}"
-    return state
+        return {"error_message": f"Embedding error: {e}"}
 
-def query_vector_service(state: ChatState) -> ChatState:
+def query_vector_service(state: ChatState) -> dict:
+    if state.get("prefetched"):
+        return {"retrieved_chunks": state["retrieved_chunks"]}
+    if not state.get("embedding"):
+        return {"retrieved_chunks": []}
     try:
         response = requests.post(VECTOR_SERVICE_URL, json={
             "embedding": state["embedding"]
         })
         response.raise_for_status()
-        state["retrieved_chunks"] = response.json().get("chunks", [])
+        return {"retrieved_chunks": response.json().get("chunks", [])}
     except Exception as e:
-        state["retrieved_chunks"] = []
-        state["error_message"] = f"Vector service error: {e}"
-    return state
+        return {"retrieved_chunks": [], "error_message": f"Vector service error: {e}"}
 
 def generate_answer(state: ChatState) -> ChatState:
     try:
         session_id = state["session_id"]
-        if not session_exists(session_id):
-            save_session(session_id, datetime.utcnow())
-
-        save_chat_message(session_id, "user", state["user_input"])
+        repo.save_chat_message(session_id, "user", state["user_input"])
 
         payload = {
             "session_id": session_id,
@@ -124,29 +222,34 @@ def generate_answer(state: ChatState) -> ChatState:
         res = requests.post(AI_SERVICE_URL, json=payload, stream=True)
         res.raise_for_status()
 
-        answer = ""
-        for chunk in res.iter_content(chunk_size=1):
-            answer += chunk.decode()
+        # Forward chunks to the answer buffer as they arrive so clients see them live
+        buffer = answer_store.get(state.get("message_id"))
+        raw = bytearray()
+        for chunk in res.iter_content(chunk_size=None):
+            raw.extend(chunk)
+            if buffer:
+                buffer.write(chunk)
 
+        answer = raw.decode("utf-8", errors="replace")
         state["final_answer"] = answer
 
-        save_user_question(session_id, state["user_input"], answer, state["embedding"])
-        save_chat_message(session_id, "assistant", answer)
+        repo.save_user_question(session_id, state["user_input"], answer, state["embedding"])
+        repo.save_chat_message(session_id, "assistant", answer)
 
-        if get_total_chat_messages(session_id) % 6 == 0:
-            last_6 = get_last_n_messages(session_id, 6)
+        if repo.get_total_chat_messages(session_id) % 6 == 0:
+            last_6 = repo.get_last_n_messages(session_id, 6)
             last_6_str = "\n".join([f"User: {q}\nBot: {a}" for q, a in last_6])
-            prev_summary = get_chat_summary(session_id)
+            prev_summary = repo.get_chat_summary(session_id)
             summary_res = requests.post(SUMMARY_URL, json={
                 "previous_summary": prev_summary,
                 "new_dialogue": last_6_str
             })
             if summary_res.status_code == 200:
                 new_summary = summary_res.json().get("summary", "")
-                save_chat_summary(session_id, new_summary)
+                repo.save_chat_summary(session_id, new_summary)
 
     except Exception as e:
-        state["final_answer"] = "Sorry, internal error occurred."
+        state["final_answer"] = AI_ERROR_ANSWER
         state["error_message"] = f"AI service error: {e}"
 
     return state
@@ -155,25 +258,48 @@ def generate_answer(state: ChatState) -> ChatState:
 def create_workflow():
     graph = StateGraph(ChatState)
     graph.add_node("check_input", check_input)
+    graph.add_node("load_context", load_context)
     graph.add_node("embed_text", embed_text)
     graph.add_node("query_vector", query_vector_service)
     graph.add_node("generate_answer", generate_answer)
     graph.set_entry_point("check_input")
-    graph.add_conditional_edges(
-        "check_input",
-        route_after_input_check,
-        {
-            "generate_answer": "generate_answer",
-            "embed_text": "embed_text"
-        }
-    )
+    # DB reads/session upsert run alongside embed -> retrieve and join before generation
+    graph.add_edge("check_input", "load_context")
+    graph.add_edge("check_input", "embed_text")
     graph.add_edge("embed_text", "query_vector")
-    graph.add_edge("query_vector", "generate_answer")
+    graph.add_edge(["load_context", "query_vector"], "generate_answer")
     graph.add_edge("generate_answer", END)
     return graph.compile()
 
 chat_flow = create_workflow()
 
+def run_chat_turn(init_state: ChatState, buffer):
+    """Run the workflow for one turn, independent of the client connection"""
+    started = time.perf_counter()
+    try:
+        result = chat_flow.invoke(init_state)
+        # Image turns and early failures produce no streamed chunks
+        if not buffer.size:
+            buffer.write(result["final_answer"].encode())
+        elif result["final_answer"] == AI_ERROR_ANSWER:
+            buffer.write(INTERRUPTED_MARKER.encode())
+    except Exception as e:
+        print(f"❌ Chat turn error: {e}")
+        if not buffer.size:
+            buffer.write(b"Sorry, there was an error processing your request.")
+        else:
+            buffer.write(INTERRUPTED_MARKER.encode())
+    finally:
+        buffer.finish()
+        turn_latency.record(time.perf_counter() - started)
+
+def reject_turn(buffer, message: str, status: int, retry_after: float = 1.0) -> Response:
+    """Drop a turn that was not admitted so a later retry can run it"""
+    answer_store.discard(buffer.message_id)
+    buffer.finish()
+    return Response(message, content_type="text/plain", status=status,
+                    headers={"Retry-After": str(math.ceil(retry_after)), "X-Message-Id": buffer.message_id})
+
 @app.route("/chat", methods=["POST", "OPTIONS"])  # Add OPTIONS method
 def chat_route():
     # Handle preflight requests
@@ -185,14 +311,33 @@ def chat_route():
         return response
     
     # Your existing chat_route code here...
+    buffer, created = None, False
     try:
         session_id = request.form.get("session_id")
         message = request.form.get("message", "")
         file = request.files.get("file")
         file_type = request.form.get("file_type")
+        message_id = request.form.get("message_id") or uuid.uuid4().hex
+        offset = max(request.form.get("offset", 0, type=int), 0)
+
+        # A retried turn with the same message id is served from the buffer
+        buffer, created = answer_store.get_or_create(message_id, session_id)
+        if buffer is None:
+            return Response("Message id belongs to another session.",
+                            content_type="text/plain", status=409)
+        headers = {"X-Message-Id": message_id}
+        if not created:
+            return Response(stream_with_context(iter_bytes(buffer, offset)),
+                            content_type="text/plain", headers=headers)
+
+        # Resumes above are free; only new turns spend rate-limit tokens
+        retry_after = acquire((ip_limiter, client_ip()), (session_limiter, session_id))
+        if retry_after:
+            return reject_turn(buffer, "Too many requests, please slow down.", 429, retry_after)
 
         init_state = {
             "session_id": session_id,
+            "message_id": message_id,
             "user_input": message,
             "input_type": "text",
             "file_data": None,
@@ -200,6 +345,7 @@ def chat_route():
             "chat_history": "",
             "chat_summary": "",
             "retrieved_chunks": [],
+            "prefetched": False,
             "final_answer": "",
             "error_message": None,
         }
@@ -211,24 +357,51 @@ def chat_route():
                 "stream": file.read()
             }
 
-        summary = get_chat_summary(session_id)
-        chat_history = get_last_n_messages(session_id, 6)
-        chat_history_str = "\n".join([f"User: {q}\nBot: {a}" for q, a in chat_history])
-        init_state["chat_summary"] = summary
-        init_state["chat_history"] = chat_history_str
-
-        @stream_with_context
-        def stream_response():
-            result = chat_flow.invoke(init_state)
-            for char in result["final_answer"]:
-                yield char
-                time.sleep(0.002)
-
-        return Response(stream_response(), content_type="text/plain")
+        def shed_turn():
+            answer_store.discard(message_id)
+            buffer.write(b"The assistant is busy right now, please try again.")
+            buffer.finish()
+
+        # Image turns are the most expensive, so they are shed first under load
+        admitted = scheduler.submit(
+            session_id,
+            lambda: run_chat_turn(init_state, buffer),
+            on_shed=shed_turn,
+            low_priority=bool(file_type and file_type.startswith("image/")),
+        )
+        if not admitted:
+            return reject_turn(buffer, "The assistant is busy right now, please try again.", 503)
+
+        return Response(stream_with_context(iter_bytes(buffer, offset)),
+                        content_type="text/plain", headers=headers)
     except Exception as e:
         print(f"❌ Chat route error: {e}")
+        # Don't leave retries of this message id waiting on a turn that never started
+        if created:
+            answer_store.discard(buffer.message_id)
+            buffer.finish()
         return Response("Sorry, there was an error processing your request.", 
                        content_type="text/plain", status=500)
+
+@app.route("/chat/stream/<message_id>", methods=["GET"])
+def chat_stream_route(message_id):
+    """Resume a buffered answer as server-sent events from a byte offset"""
+    # Answers are only readable by the session that asked; a mismatch looks like an unknown id
+    session_id = request.args.get("session_id")
+    buffer = answer_store.get(message_id)
+    if buffer is None or not session_id or buffer.session_id != session_id:
+        return Response("Unknown or expired message id.", content_type="text/plain", status=404)
+
+    # EventSource sends Last-Event-ID on reconnect; the first connect uses ?offset=
+    last_event_id = request.headers.get("Last-Event-ID", "")
+    if last_event_id.isdigit():
+        offset = int(last_event_id)
+    else:
+        offset = max(request.args.get("offset", 0, type=int), 0)
+
+    return Response(stream_with_context(iter_sse(buffer, offset)),
+                    content_type="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Message-Id": message_id})
     
 def health_check():
     return {"status": "healthy", "service": "chat"}
@@ -240,8 +413,7 @@ if __name__ == "__main__":
     # Check if we need to clear database (optional - only if you want fresh start)
     if os.getenv("CLEAR_DB_ON_START", "false").lower() == "true":
         try:
-            from models import clear_database
-            clear_database()
+            repo.clear()
             print("🧹 Database cleared on startup")
         except Exception as e:
             print(f"⚠️ Could not clear database on startup: {e}")
@@ -0,0 +1,103 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from admission import LatencyWindow
+
+
+def cosine_similarity(a: list, b: list) -> float:
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return sum(x * y for x, y in zip(a, b)) / norm if norm else 0.0
+
+
+class PrefetchEntry:
+    def __init__(self, text: str, embedding: list, chunks: list, elapsed: float):
+        self.text = text
+        self.embedding = embedding
+        self.chunks = chunks
+        self.elapsed = elapsed
+        self.created_at = time.monotonic()
+
+
+class PrefetchCache:
+    """Short-lived per-session retrieval results computed from the user's draft.
+
+    A prefetch for a session is skipped while another is in flight for it,
+    if the draft is unchanged, or if the last one started less than
+    `min_interval` seconds ago. `take` hands out an entry at most once, and
+    only when the final message is the draft itself, or extends it and its
+    embedding stays within `min_similarity` (cosine) of the draft's. A small
+    text edit can flip the meaning ("sin x" vs "cos x"), so edits never match.
+    """
+
+    def __init__(self, ttl: float = 30.0, min_interval: float = 0.5, min_similarity: float = 0.95,
+                 max_inflight: int = 2, max_sessions: int = 1000):
+        self.ttl = ttl
+        self.min_interval = min_interval
+        self.min_similarity = min_similarity
+        self.max_inflight = max_inflight
+        self.max_sessions = max_sessions
+        self.hits = 0
+        self.misses = 0
+        self.saved = LatencyWindow()
+        self._entries: "OrderedDict[str, PrefetchEntry]" = OrderedDict()
+        self._last_started: dict[str, float] = {}
+        self._inflight: set[str] = set()
+        self._lock = threading.Lock()
+
+    def begin(self, session_id: str, text: str) -> bool:
+        """Claim a prefetch slot for this draft. Returns False if it should be skipped."""
+        now = time.monotonic()
+        with self._lock:
+            if session_id in self._inflight or len(self._inflight) >= self.max_inflight:
+                return False
+            started_at = self._last_started.get(session_id, 0.0)
+            if now - started_at < self.min_interval:
+                return False
+            entry = self._entries.get(session_id)
+            if entry and entry.text == text and now - entry.created_at < self.ttl:
+                return False
+            self._inflight.add(session_id)
+            self._last_started[session_id] = now
+            if len(self._last_started) > self.max_sessions:
+                self._last_started.pop(next(iter(self._last_started)))
+            return True
+
+    def finish(self, session_id: str, text: str, embedding: Optional[list], chunks: list, elapsed: float):
+        with self._lock:
+            self._inflight.discard(session_id)
+            if embedding is None:
+                return
+            self._entries.pop(session_id, None)
+            self._entries[session_id] = PrefetchEntry(text, embedding, chunks, elapsed)
+            while len(self._entries) > self.max_sessions:
+                self._entries.popitem(last=False)
+
+    def take(self, session_id: str, text: str, embedding: list) -> Optional[PrefetchEntry]:
+        """Prefetched result for the final message (and its own embedding), if it matches the draft."""
+        with self._lock:
+            entry = self._entries.pop(session_id, None)
+            fresh = entry is not None and time.monotonic() - entry.created_at < self.ttl
+            if fresh and (entry.text == text or (
+                    text.startswith(entry.text) and
+                    cosine_similarity(entry.embedding, embedding) >= self.min_similarity)):
+                self.hits += 1
+            else:
+                self.misses += 1
+                return None
+        self.saved.record(entry.elapsed)
+        return entry
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            stats = {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "cached_sessions": len(self._entries),
+            }
+        stats.update(self.saved.snapshot("saved"))
+        return stats
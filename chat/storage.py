@@ -0,0 +1,294 @@
+from abc import ABC, abstractmethod
+from datetime import datetime
+from json import dumps
+from typing import Optional
+import os
+import threading
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from models import Base, ChatSession, ChatMessage, ChatSummary, UserQuestion
+
+DB_PATH = os.path.join("data", "chat_history.db")
+DATABASE_URL = os.getenv("DATABASE_URL", f"sqlite:///{DB_PATH}")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+
+
+class ChatRepository(ABC):
+    """Storage for chat sessions, messages, question/answer pairs and summaries.
+
+    Every chat replica talks to storage only through this interface, so any
+    backend that implements it can be shared behind a load balancer.
+    """
+
+    @abstractmethod
+    def save_session(self, session_id: str, created_at: datetime): ...
+
+    @abstractmethod
+    def session_exists(self, session_id: str) -> bool: ...
+
+    @abstractmethod
+    def save_chat_message(self, session_id: str, role: str, content: str): ...
+
+    @abstractmethod
+    def get_total_chat_messages(self, session_id: str) -> int: ...
+
+    @abstractmethod
+    def save_user_question(self, session_id: str, question: str, answer: str, embedding: Optional[list]): ...
+
+    @abstractmethod
+    def get_last_n_messages(self, session_id: str, n: Optional[int] = 6) -> list[tuple[str, str]]:
+        """Last `n` (question, answer) pairs, oldest first. `n=None` returns all of them."""
+
+    @abstractmethod
+    def save_chat_summary(self, session_id: str, summary_text: str): ...
+
+    @abstractmethod
+    def get_chat_summary(self, session_id: str) -> str: ...
+
+    @abstractmethod
+    def clear(self): ...
+
+    def get_total_tokens(self, session_id: str) -> int:
+        """Get total tokens with error handling"""
+        try:
+            from transformers import AutoTokenizer
+            tokenizer = AutoTokenizer.from_pretrained("bert-base-uncased")
+
+            total_tokens = 0
+            for question, answer in self.get_last_n_messages(session_id, None):
+                combined = f"User: {question}\nBot: {answer}"
+                total_tokens += len(tokenizer.encode(combined, add_special_tokens=False))
+            return total_tokens
+        except Exception as e:
+            print(f"❌ Error calculating tokens: {e}")
+            return 0
+
+
+class SQLChatRepository(ChatRepository):
+    """SQLAlchemy-backed repository: local SQLite by default, or any pooled server database."""
+
+    def __init__(self, url: str = DATABASE_URL):
+        self.url = url
+        self.engine = None
+        self.Session = None
+        self._init_lock = threading.Lock()
+
+    @property
+    def is_sqlite(self) -> bool:
+        return self.url.startswith("sqlite")
+
+    def init_database(self):
+        """Initialize database with proper error handling"""
+        if self.is_sqlite:
+            # Ensure data directory exists with proper permissions
+            db_dir = os.path.dirname(self.url.split(":///", 1)[-1])
+            if db_dir:
+                os.makedirs(db_dir, mode=0o755, exist_ok=True)
+            self.engine = create_engine(
+                self.url,
+                connect_args={
+                    'check_same_thread': False,
+                    'timeout': 30
+                },
+                echo=False
+            )
+        else:
+            # Shared server database: pooled connections, checked before use
+            self.engine = create_engine(
+                self.url,
+                pool_size=DB_POOL_SIZE,
+                max_overflow=DB_MAX_OVERFLOW,
+                pool_recycle=DB_POOL_RECYCLE,
+                pool_pre_ping=True,
+                echo=False
+            )
+
+        try:
+            # Create all tables
+            Base.metadata.create_all(self.engine)
+            self.Session = sessionmaker(bind=self.engine)
+            print("✅ Database tables created successfully")
+            return True
+        except Exception as e:
+            print(f"❌ Error creating database tables: {e}")
+            return False
+
+    def _session(self):
+        # Parallel graph branches and scheduler workers can hit the first call together
+        if not self.Session:
+            with self._init_lock:
+                if not self.Session:
+                    self.init_database()
+        return self.Session()
+
+    def save_session(self, session_id, created_at):
+        """Save session with error handling"""
+        session = self._session()
+        try:
+            # Check if session already exists
+            existing = session.query(ChatSession).filter_by(id=session_id).first()
+            if not existing:
+                new_session = ChatSession(id=session_id, created_at=created_at)
+                session.add(new_session)
+                session.commit()
+                print(f"🛠️ Saving session: {session_id}")
+        except Exception as e:
+            print(f"❌ Error saving session: {e}")
+            session.rollback()
+        finally:
+            session.close()
+
+    def session_exists(self, session_id):
+        """Check if session exists with error handling"""
+        session = self._session()
+        try:
+            return session.query(ChatSession).filter_by(id=session_id).first() is not None
+        except Exception as e:
+            print(f"❌ Error checking session existence: {e}")
+            return False
+        finally:
+            session.close()
+
+    def save_chat_message(self, session_id, role, content):
+        """Save chat message with error handling"""
+        session = self._session()
+        try:
+            new_message = ChatMessage(
+                session_id=session_id,
+                role=role,
+                content=content,
+                created_at=datetime.utcnow()
+            )
+            session.add(new_message)
+            session.commit()
+        except Exception as e:
+            print(f"❌ Error saving chat message: {e}")
+            session.rollback()
+        finally:
+            session.close()
+
+    def get_total_chat_messages(self, session_id):
+        """Get total chat messages with error handling"""
+        session = self._session()
+        try:
+            return session.query(ChatMessage).filter_by(session_id=session_id).count()
+        except Exception as e:
+            print(f"❌ Error getting message count: {e}")
+            return 0
+        finally:
+            session.close()
+
+    def save_user_question(self, session_id, question, answer, embedding):
+        """Save user question with error handling"""
+        session = self._session()
+        try:
+            entry = UserQuestion(
+                session_id=session_id,
+                question=question,
+                answer=answer,
+                embedding=dumps(embedding)
+            )
+            session.add(entry)
+            session.commit()
+        except Exception as e:
+            print(f"❌ Error saving user question: {e}")
+            session.rollback()
+        finally:
+            session.close()
+
+    def get_last_n_messages(self, session_id, n=6):
+        """Get last N messages with error handling"""
+        session = self._session()
+        try:
+            messages = (
+                session.query(UserQuestion)
+                .filter_by(session_id=session_id)
+                .order_by(UserQuestion.id.desc())
+                .limit(n)
+                .all()
+            )
+            return list(reversed([(msg.question, msg.answer) for msg in messages]))
+        except Exception as e:
+            print(f"❌ Error getting messages: {e}")
+            return []
+        finally:
+            session.close()
+
+    def save_chat_summary(self, session_id, summary_text):
+        """Save chat summary with error handling"""
+        session = self._session()
+        try:
+            summary = session.query(ChatSummary).filter_by(session_id=session_id).first()
+            if summary:
+                print(f"🟡 Updating existing summary for session: {session_id}")
+                summary.summary_text = summary_text
+                summary.updated_at = datetime.utcnow()
+            else:
+                print(f"🟢 Creating new summary for session: {session_id}")
+                summary = ChatSummary(
+                    session_id=session_id,
+                    summary_text=summary_text,
+                    updated_at=datetime.utcnow()
+                )
+                session.add(summary)
+            session.commit()
+        except Exception as e:
+            print(f"❌ Error updating summary: {e}")
+            session.rollback()
+        finally:
+            session.close()
+
+    def get_chat_summary(self, session_id):
+        """Get chat summary with error handling"""
+        session = self._session()
+        try:
+            summary = session.query(ChatSummary).filter_by(session_id=session_id).first()
+            return summary.summary_text if summary else ""
+        except Exception as e:
+            print(f"❌ Error getting summary: {e}")
+            return ""
+        finally:
+            session.close()
+
+    def clear(self):
+        """Clear database with proper error handling - safer approach"""
+        session = self._session()
+        try:
+            # Instead of dropping tables, just delete all records
+            print("🧹 Clearing database records...")
+            session.query(ChatMessage).delete()
+            session.query(UserQuestion).delete()
+            session.query(ChatSummary).delete()
+            session.query(ChatSession).delete()
+            session.commit()
+            print("✅ Database records cleared successfully")
+        except Exception as e:
+            print(f"❌ Error clearing database records: {e}")
+            session.rollback()
+            if not self.is_sqlite:
+                return
+            # If that fails, try the file deletion approach
+            try:
+                session.close()
+                self.engine.dispose()
+
+                db_path = self.url.split(":///", 1)[-1]
+                if os.path.exists(db_path) and os.access(db_path, os.W_OK):
+                    os.remove(db_path)
+                    print("🗑️ Database file removed as fallback")
+                    self.init_database()
+                else:
+                    print("⚠️ Cannot remove database file - insufficient permissions")
+            except Exception as e2:
+                print(f"❌ Fallback clear also failed: {e2}")
+        finally:
+            session.close()
+
+
+def create_repository(url: str = DATABASE_URL) -> ChatRepository:
+    """Repository for DATABASE_URL, e.g. postgresql+psycopg2://user:pass@db/chat"""
+    return SQLChatRepository(url)
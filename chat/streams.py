@@ -0,0 +1,136 @@
+import codecs
+import threading
+import time
+from collections import OrderedDict
+from typing import Iterator, Optional
+
+
+class AnswerBuffer:
+    """Bytes generated for one answer, readable from any offset while it grows."""
+
+    def __init__(self, message_id: str, session_id: str):
+        self.message_id = message_id
+        self.session_id = session_id
+        self.data = bytearray()
+        self.done = False
+        self.updated_at = time.monotonic()
+        self._cond = threading.Condition()
+
+    @property
+    def size(self) -> int:
+        return len(self.data)
+
+    def write(self, chunk: bytes):
+        if not chunk:
+            return
+        with self._cond:
+            self.data.extend(chunk)
+            self.updated_at = time.monotonic()
+            self._cond.notify_all()
+
+    def finish(self):
+        with self._cond:
+            self.done = True
+            self.updated_at = time.monotonic()
+            self._cond.notify_all()
+
+    def read(self, offset: int, timeout: float = 15.0) -> tuple[bytes, bool]:
+        """Wait until there is data past `offset` (or the answer is done)."""
+        with self._cond:
+            self._cond.wait_for(lambda: self.done or len(self.data) > offset, timeout)
+            return bytes(self.data[offset:]), self.done
+
+
+class AnswerStore:
+    """Bounded ring of recent answers keyed by message id.
+
+    Finished answers are kept for `ttl` seconds so a retried or resumed turn
+    is served from memory instead of being generated and persisted again.
+    """
+
+    def __init__(self, max_answers: int = 256, ttl: float = 600.0):
+        self.max_answers = max_answers
+        self.ttl = ttl
+        self._answers: "OrderedDict[str, AnswerBuffer]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, message_id: Optional[str]) -> Optional[AnswerBuffer]:
+        if not message_id:
+            return None
+        with self._lock:
+            return self._answers.get(message_id)
+
+    def get_or_create(self, message_id: str, session_id: str) -> tuple[Optional[AnswerBuffer], bool]:
+        """Return (buffer, created). The buffer is None if the id belongs to another session."""
+        with self._lock:
+            self._evict()
+            buffer = self._answers.get(message_id)
+            if buffer is not None:
+                if buffer.session_id != session_id:
+                    return None, False
+                return buffer, False
+            buffer = AnswerBuffer(message_id, session_id)
+            self._answers[message_id] = buffer
+            return buffer, True
+
+    def discard(self, message_id: str):
+        with self._lock:
+            self._answers.pop(message_id, None)
+
+    def _evict(self):
+        now = time.monotonic()
+        for message_id, buffer in list(self._answers.items()):
+            if buffer.done and now - buffer.updated_at > self.ttl:
+                del self._answers[message_id]
+        # Oldest first; answers still being generated are never dropped
+        for message_id, buffer in list(self._answers.items()):
+            if len(self._answers) < self.max_answers:
+                break
+            if buffer.done:
+                del self._answers[message_id]
+
+
+def iter_bytes(buffer: AnswerBuffer, offset: int = 0) -> Iterator[bytes]:
+    """Raw answer bytes from `offset` until the answer is finished."""
+    while True:
+        data, done = buffer.read(offset)
+        if data:
+            offset += len(data)
+            yield data
+        if done and offset >= buffer.size:
+            return
+
+
+def iter_sse(buffer: AnswerBuffer, offset: int = 0) -> Iterator[str]:
+    """Server-sent events whose ids are byte offsets, usable as Last-Event-ID."""
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    # Raw bytes read so far vs. bytes that decoded to whole characters and were sent;
+    # a character split across chunks stays in the decoder until the rest arrives.
+    read_offset = sent_offset = offset
+    held = ""  # trailing "\r" that may be the first half of a "\r\n"
+    while True:
+        data, done = buffer.read(read_offset)
+        if data:
+            read_offset += len(data)
+            text = held + decoder.decode(data)
+            sent_offset = read_offset - len(decoder.getstate()[0])
+            held = "\r" if text.endswith("\r") else ""
+            if held:
+                text, sent_offset = text[:-1], sent_offset - 1
+            if text:
+                yield _sse_data(sent_offset, text)
+        elif not done:
+            yield ": keepalive\n\n"
+        if done and read_offset >= buffer.size:
+            tail = held + decoder.decode(b"", final=True)
+            if tail:
+                yield _sse_data(read_offset, tail)
+            yield f"id: {read_offset}\nevent: done\ndata: \n\n"
+            return
+
+
+def _sse_data(event_id: int, text: str) -> str:
+    # SSE treats \r, \n and \r\n all as line ends, so normalise before framing
+    text = text.replace("\r\n", "\n").replace("\r", "\n")
+    lines = "\n".join(f"data: {line}" for line in text.split("\n"))
+    return f"id: {event_id}\n{lines}\n\n"
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The chat service runs with chat/ as its working directory and imports flat modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
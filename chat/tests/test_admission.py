@@ -0,0 +1,80 @@
+import threading
+import time
+
+from admission import FairScheduler, RateLimiter, acquire
+
+
+def test_acquire_charges_nothing_when_any_bucket_is_empty():
+    ip = RateLimiter(60, 2)
+    session = RateLimiter(60, 1)
+
+    assert acquire((ip, "1.2.3.4"), (session, "s1")) == 0
+    assert acquire((ip, "1.2.3.4"), (session, "s1")) > 0
+
+    # The session rejection above must not have spent the IP token
+    assert acquire((ip, "1.2.3.4"), (session, "s2")) == 0
+
+
+def test_acquire_admits_at_most_burst_under_concurrency(monkeypatch):
+    limiter = RateLimiter(rate_per_min=0.001, burst=3)
+    wait_time = RateLimiter.wait_time
+
+    def slow_wait_time(self, key):
+        # Widen the gap between check and charge to expose races
+        result = wait_time(self, key)
+        time.sleep(0.01)
+        return result
+
+    monkeypatch.setattr(RateLimiter, "wait_time", slow_wait_time)
+
+    barrier = threading.Barrier(20)
+    admitted = []
+
+    def turn():
+        barrier.wait()
+        if acquire((limiter, "s1")) == 0:
+            admitted.append(1)
+
+    threads = [threading.Thread(target=turn) for _ in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(admitted) == 3
+    assert limiter._buckets["s1"].tokens >= 0
+
+
+def test_scheduler_round_robins_across_sessions():
+    gate = threading.Event()
+    done = threading.Event()
+    order = []
+    scheduler = FairScheduler(workers=1, max_depth=8, shed_depth=4)
+    scheduler.submit("blocker", gate.wait)
+    time.sleep(0.05)
+
+    for i in range(3):
+        scheduler.submit("a", lambda i=i: order.append(("a", i)))
+    scheduler.submit("b", lambda: order.append(("b", 0)))
+    scheduler.submit("b", done.set)
+
+    gate.set()
+    assert done.wait(2)
+    assert order == [("a", 0), ("b", 0), ("a", 1), ("a", 2)]
+
+
+def test_scheduler_sheds_image_jobs_first():
+    gate = threading.Event()
+    shed = []
+    scheduler = FairScheduler(workers=1, max_depth=2, shed_depth=2)
+    scheduler.submit("blocker", gate.wait)
+    time.sleep(0.05)
+
+    assert scheduler.submit("a", lambda: None)
+    assert scheduler.submit("img", lambda: None, on_shed=lambda: shed.append("img"), low_priority=True)
+    # Queue full: a text turn displaces the queued image turn, another image is refused
+    assert scheduler.submit("b", lambda: None)
+    assert shed == ["img"]
+    assert not scheduler.submit("img2", lambda: None, low_priority=True)
+
+    gate.set()
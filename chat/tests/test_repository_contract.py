@@ -0,0 +1,97 @@
+"""Contract every ChatRepository backend must satisfy.
+
+SQLite always runs. Set CHAT_TEST_DATABASE_URL (e.g. a throwaway Postgres
+database) to run the same suite against a server backend.
+"""
+import os
+import threading
+from datetime import datetime
+
+import pytest
+
+from storage import ChatRepository, create_repository
+
+BACKENDS = ["sqlite"]
+if os.getenv("CHAT_TEST_DATABASE_URL"):
+    BACKENDS.append(os.environ["CHAT_TEST_DATABASE_URL"])
+
+
+@pytest.fixture(params=BACKENDS)
+def repo(request, tmp_path) -> ChatRepository:
+    url = f"sqlite:///{tmp_path / 'data' / 'chat_history.db'}" if request.param == "sqlite" else request.param
+    repository = create_repository(url)
+    repository.clear()
+    yield repository
+    repository.clear()
+
+
+def test_session_upsert_is_idempotent(repo):
+    assert not repo.session_exists("s1")
+    repo.save_session("s1", datetime.utcnow())
+    repo.save_session("s1", datetime.utcnow())
+    assert repo.session_exists("s1")
+    assert not repo.session_exists("s2")
+
+
+def test_chat_messages_are_counted_per_session(repo):
+    repo.save_chat_message("s1", "user", "What is Avogadro's number?")
+    repo.save_chat_message("s1", "assistant", "6.022 x 10^23")
+    repo.save_chat_message("s2", "user", "Hi")
+    assert repo.get_total_chat_messages("s1") == 2
+    assert repo.get_total_chat_messages("s2") == 1
+    assert repo.get_total_chat_messages("missing") == 0
+
+
+def test_last_n_messages_are_oldest_first(repo):
+    for i in range(4):
+        repo.save_user_question("s1", f"q{i}", f"a{i}", [0.1 * i, 0.2])
+    repo.save_user_question("s2", "other", "other", None)
+
+    assert repo.get_last_n_messages("s1", 2) == [("q2", "a2"), ("q3", "a3")]
+    assert repo.get_last_n_messages("s1", None) == [(f"q{i}", f"a{i}") for i in range(4)]
+    assert repo.get_last_n_messages("missing") == []
+
+
+def test_summary_upsert(repo):
+    assert repo.get_chat_summary("s1") == ""
+    repo.save_chat_summary("s1", "first")
+    repo.save_chat_summary("s1", "second")
+    assert repo.get_chat_summary("s1") == "second"
+    assert repo.get_chat_summary("s2") == ""
+
+
+def test_clear_removes_everything(repo):
+    repo.save_session("s1", datetime.utcnow())
+    repo.save_chat_message("s1", "user", "q")
+    repo.save_user_question("s1", "q", "a", [0.1])
+    repo.save_chat_summary("s1", "summary")
+
+    repo.clear()
+
+    assert not repo.session_exists("s1")
+    assert repo.get_total_chat_messages("s1") == 0
+    assert repo.get_last_n_messages("s1", None) == []
+    assert repo.get_chat_summary("s1") == ""
+
+
+def test_first_use_from_many_threads_initializes_once(tmp_path):
+    repo = create_repository(f"sqlite:///{tmp_path / 'chat_history.db'}")
+    barrier = threading.Barrier(8)
+    engines, errors = set(), []
+
+    def first_call():
+        barrier.wait()
+        try:
+            repo.session_exists("s1")
+            engines.add(id(repo.engine))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=first_call) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert len(engines) == 1
@@ -0,0 +1,71 @@
+import threading
+import time
+
+from streams import AnswerBuffer, AnswerStore, iter_bytes, iter_sse
+
+
+def sse_text(events):
+    """Reassemble the text an EventSource client would see from data events."""
+    messages = []
+    for event in events:
+        lines = event.rstrip("\n").split("\n")
+        if any(line.startswith("event:") for line in lines) or event.startswith(":"):
+            continue
+        messages.append("\n".join(line[len("data: "):] for line in lines if line.startswith("data: ")))
+    return "".join(messages)
+
+
+def write_later(buffer, chunks, delay=0.05):
+    def run():
+        for chunk in chunks:
+            buffer.write(chunk)
+            time.sleep(delay)
+        buffer.finish()
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread
+
+
+def test_split_utf8_character_waits_instead_of_spinning():
+    buffer = AnswerBuffer("m1", "s1")
+    reads = []
+    read = buffer.read
+    buffer.read = lambda offset, timeout=15.0: reads.append(offset) or read(offset, timeout)
+
+    encoded = "héllo π".encode()
+    thread = write_later(buffer, [encoded[:2], encoded[2:-1], encoded[-1:]], delay=0.2)
+    events = list(iter_sse(buffer))
+    thread.join()
+
+    assert sse_text(events) == "héllo π"
+    assert len(reads) < 10
+    assert events[-1].endswith("event: done\ndata: \n\n")
+
+
+def test_carriage_returns_do_not_break_framing():
+    buffer = AnswerBuffer("m1", "s1")
+    thread = write_later(buffer, [b"a\rb\r", b"\nc\r\nd"])
+    events = list(iter_sse(buffer))
+    thread.join()
+
+    assert all("\r" not in event for event in events)
+    assert sse_text(events) == "a\nb\nc\nd"
+
+
+def test_event_ids_resume_from_byte_offsets():
+    buffer = AnswerBuffer("m1", "s1")
+    buffer.write("x²=4\n".encode())
+    buffer.finish()
+
+    first = list(iter_sse(buffer))[0]
+    event_id = int(first.split("\n")[0][len("id: "):])
+    assert event_id == len("x²=4\n".encode())
+    assert b"".join(iter_bytes(buffer, 1)) == "²=4\n".encode()
+
+
+def test_store_keeps_message_ids_per_session():
+    store = AnswerStore(max_answers=2)
+    buffer, created = store.get_or_create("m1", "s1")
+    assert created
+    assert store.get_or_create("m1", "s1") == (buffer, False)
+    assert store.get_or_create("m1", "other") == (None, False)
@@ -2,6 +2,8 @@ from flask import Flask, request, jsonify
 from chromadb import PersistentClient
 # from chromadb.utils.embedding_functions import embedding_function_factory
 from dotenv import load_dotenv
+from rerank import adaptive_cutoff, estimate_tokens, mmr_select
+import numpy as np
 import os
 
 load_dotenv()
@@ -13,6 +15,14 @@ CHROMA_PATH = os.getenv("CHROMA_PATH", "./rag_store")
 TOP_K = int(os.getenv("TOP_K", "5"))
 DISTANCE_THRESHOLD = float(os.getenv("SIMILARITY_THRESHOLD", "0.75"))
 
+# Re-ranking: fetch a wider candidate set, cut it adaptively, then pick diverse chunks with MMR
+CANDIDATE_K = int(os.getenv("CANDIDATE_K", "20"))
+CUTOFF_SPREAD = float(os.getenv("CUTOFF_SPREAD", "1.0"))
+MIN_CHUNKS = int(os.getenv("MIN_CHUNKS", "2"))
+MMR_LAMBDA = float(os.getenv("MMR_LAMBDA", "0.7"))
+MAX_REDUNDANCY = float(os.getenv("MAX_REDUNDANCY", "0.95"))
+MMR_MIN_GAIN = float(os.getenv("MMR_MIN_GAIN", "0.5"))
+
 # Initialize Chroma client
 chroma_client = PersistentClient(path=CHROMA_PATH)
 collection = chroma_client.get_or_create_collection(name="rag_documents")
@@ -28,23 +38,40 @@ def query():
     try:
         results = collection.query(
             query_embeddings=[embedding],
-            n_results=TOP_K,
-            include=["documents", "distances"]
+            n_results=max(CANDIDATE_K, TOP_K),
+            include=["documents", "distances", "embeddings"]
         )
 
         chunks = results.get("documents", [[]])[0]
-        distances = results.get("distances", [[]])[0]
+        distances = np.asarray(results.get("distances", [[]])[0], dtype=float)
+        embeddings = results.get("embeddings")
+        candidates = np.asarray(embeddings[0] if embeddings is not None else [], dtype=float)
 
-        filtered = [
-            chunk for chunk, dist in zip(chunks, distances)
-            if dist < DISTANCE_THRESHOLD
-        ]
+        # Chroma returns candidates nearest first, so the cutoff keeps a prefix
+        # DISTANCE_THRESHOLD stays as an absolute floor under the adaptive cutoff
+        keep = adaptive_cutoff(distances, spread=CUTOFF_SPREAD, min_keep=MIN_CHUNKS,
+                               max_distance=DISTANCE_THRESHOLD)
+        picked = mmr_select(
+            np.asarray(embedding, dtype=float), candidates[:keep], TOP_K,
+            lambda_mult=MMR_LAMBDA, max_redundancy=MAX_REDUNDANCY, min_gain=MMR_MIN_GAIN
+        ) if len(candidates) else list(range(min(keep, TOP_K)))
+        selected = [chunks[i] for i in picked]
 
-        # fallback: return top 2 even if none pass threshold
-        if not filtered and chunks:
-            filtered = chunks[:2]
+        # What the fixed threshold would have sent, for reporting the savings
+        baseline = [
+            chunk for chunk, dist in zip(chunks[:TOP_K], distances[:TOP_K])
+            if dist < DISTANCE_THRESHOLD
+        ] or chunks[:2]
+        stats = {
+            "candidates": len(chunks),
+            "after_cutoff": keep,
+            "selected": len(selected),
+            "baseline_chunks": len(baseline),
+            "tokens_saved": sum(map(estimate_tokens, baseline)) - sum(map(estimate_tokens, selected)),
+        }
+        print(f"🔎 Query re-ranked: {stats}")
 
-        return jsonify({"chunks": filtered})
+        return jsonify({"chunks": selected, "stats": stats})
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -0,0 +1,64 @@
+import numpy as np
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough prompt-token count (~4 characters per token)."""
+    return max(1, len(text) // 4) if text else 0
+
+
+def adaptive_cutoff(distances: np.ndarray, spread: float = 1.0, min_keep: int = 2,
+                    max_distance: float = np.inf) -> int:
+    """Number of leading candidates close enough to the best match to consider.
+
+    Candidates farther than `min + spread * std` of this query's own distance
+    distribution are dropped, so tight clusters keep few chunks and flat
+    distributions keep more. Anything beyond the absolute `max_distance` is
+    dropped too; if that leaves nothing, the first `min_keep` are kept.
+    """
+    if len(distances) == 0:
+        return 0
+    cutoff = min(distances.min() + spread * distances.std(), max_distance)
+    keep = int(np.count_nonzero(distances <= cutoff))
+    return keep or min(len(distances), min_keep)
+
+
+def mmr_select(query: np.ndarray, candidates: np.ndarray, k: int,
+               lambda_mult: float = 0.7, max_redundancy: float = 0.95,
+               min_gain: float = 0.5) -> list[int]:
+    """Maximal marginal relevance over cosine similarity.
+
+    Picks at most `k` candidate indices, trading relevance to the query against
+    similarity to chunks already picked. Stops as soon as the best remaining
+    MMR score drops below `min_gain` times the first pick's score (mostly
+    overlap, little new relevance), or every remaining candidate is a near
+    duplicate (similarity >= `max_redundancy`) of one already selected.
+    """
+    if len(candidates) == 0 or k <= 0:
+        return []
+
+    query = query / (np.linalg.norm(query) or 1.0)
+    norms = np.linalg.norm(candidates, axis=1, keepdims=True)
+    candidates = candidates / np.where(norms == 0, 1.0, norms)
+
+    relevance = candidates @ query
+    redundancy = np.full(len(candidates), -np.inf)
+    available = np.ones(len(candidates), dtype=bool)
+    selected = [int(np.argmax(relevance))]
+    min_score = min_gain * lambda_mult * relevance[selected[0]]
+
+    while len(selected) < min(k, len(candidates)):
+        last = selected[-1]
+        available[last] = False
+        # Only the newest pick can raise a candidate's max similarity to the selection
+        redundancy = np.maximum(redundancy, candidates @ candidates[last])
+        eligible = available & (redundancy < max_redundancy)
+        if not eligible.any():
+            break
+        scores = lambda_mult * relevance - (1 - lambda_mult) * redundancy
+        scores[~eligible] = -np.inf
+        best = int(np.argmax(scores))
+        if scores[best] < min_score:
+            break
+        selected.append(best)
+
+    return selected
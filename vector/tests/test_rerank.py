@@ -0,0 +1,61 @@
+import numpy as np
+
+from rerank import adaptive_cutoff, estimate_tokens, mmr_select
+
+
+def unit(*values):
+    vector = np.asarray(values, dtype=float)
+    return vector / np.linalg.norm(vector)
+
+
+def test_cutoff_keeps_tight_cluster_only():
+    distances = np.array([0.20, 0.21, 0.22, 0.60, 0.65, 0.70])
+    assert adaptive_cutoff(distances, spread=0.5) == 3
+
+
+def test_cutoff_applies_absolute_floor():
+    distances = np.array([0.30, 0.50, 0.70, 0.90])
+    assert adaptive_cutoff(distances, spread=2.0, max_distance=0.6) == 2
+
+
+def test_cutoff_falls_back_to_min_keep_for_weak_queries():
+    # Nothing is close enough: same as the old "top 2" fallback, not 6 chunks
+    distances = np.linspace(0.8, 1.4, 10)
+    assert adaptive_cutoff(distances, spread=1.0, min_keep=2, max_distance=0.75) == 2
+
+
+def test_cutoff_empty():
+    assert adaptive_cutoff(np.array([])) == 0
+
+
+def test_mmr_skips_near_duplicates():
+    query = unit(1, 0, 0)
+    candidates = np.array([unit(1, 0.1, 0), unit(1, 0.1001, 0), unit(1, 0, 0.8)])
+    assert mmr_select(query, candidates, k=3, min_gain=0.0) == [0, 2]
+
+
+def test_mmr_stops_when_marginal_gain_is_low():
+    query = unit(1, 0, 0)
+    # Second and third chunks overlap heavily with the first and add little
+    candidates = np.array([unit(1, 0.2, 0), unit(1, 0.5, 0), unit(1, 0.6, 0.1)])
+    assert mmr_select(query, candidates, k=3, max_redundancy=1.0, min_gain=0.9) == [0]
+    assert len(mmr_select(query, candidates, k=3, max_redundancy=1.0, min_gain=0.0)) == 3
+
+
+def test_mmr_respects_k_and_prefers_distinct_chunks():
+    query = unit(1, 1, 0)
+    candidates = np.array([unit(1, 0.9, 0), unit(1, 0.8, 0), unit(0.8, 1, 0.2), unit(0, 0, 1)])
+    picked = mmr_select(query, candidates, k=2, min_gain=0.0)
+    assert len(picked) == 2
+    assert picked[0] == 0
+
+
+def test_mmr_empty_inputs():
+    assert mmr_select(unit(1, 0), np.empty((0, 2)), k=3) == []
+    assert mmr_select(unit(1, 0), np.array([unit(1, 0)]), k=0) == []
+
+
+def test_estimate_tokens():
+    assert estimate_tokens("") == 0
+    assert estimate_tokens("abc") == 1
+    assert estimate_tokens("a" * 40) == 10